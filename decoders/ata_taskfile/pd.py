@@ -32,11 +32,16 @@
 # - The sigrok PD API is stable, but if you run an older release you might
 #   need to adapt small API details.
 
+from types import MappingProxyType
 import sigrokdecode as srd
 
 # -------------------------- Command & CDB tables ----------------------------
 
-ATA_COMMANDS = {
+# decode() only uses the opcode lookup tuples built from these tables at
+# import time, so changes made at runtime are ignored. The built-in tables
+# are read-only; add entries to CUSTOM_ATA_COMMANDS / CUSTOM_ATAPI_CDB by
+# editing them in this file.
+ATA_COMMANDS = MappingProxyType({
     0x00: "NOP",
     0x06: "DATA SET MANAGEMENT",
     0x07: "DATA SET MANAGEMENT XL",
@@ -166,18 +171,19 @@
 
     0xF8: "READ NATIVE MAX ADDRESS",
     0xF9: "SET MAX ADDRESS",
-}
+})
 
 # Vendor/custom ranges (used only for labeling hints, not enforced)
-VENDOR_RANGES = [(0x80,0x8F),(0x9A,0x9E),(0xC1,0xC3),(0xF0,0xF0),(0xFA,0xFF)]
+VENDOR_RANGES = ((0x80,0x8F),(0x9A,0x9E),(0xC1,0xC3),(0xF0,0xF0),(0xFA,0xFF))
 
-# User-extensible override map (takes precedence over ATA_COMMANDS)
+# User-extensible override map (takes precedence over ATA_COMMANDS); edit
+# in the source, runtime changes are ignored
 CUSTOM_ATA_COMMANDS = {
     # 0xXY: 'YourVendor Foo',
 }
 
 # Common ATAPI/SCSI CDB mnemonics (subset; extend as needed)
-ATAPI_CDB = {
+ATAPI_CDB = MappingProxyType({
     0x00: 'TEST UNIT READY',
     0x03: 'REQUEST SENSE',
     0x12: 'INQUIRY',
@@ -199,7 +205,7 @@
     0x5A: 'MODE SENSE(10)',
     0xA1: 'BLANK (MMC)',
     0xBB: 'SET CD SPEED (MMC)',
-}
+})
 
 # Sony vendor CDBs (classic)
 CUSTOM_ATAPI_CDB = {
@@ -214,6 +220,74 @@
     0xC9: 'SONY: PLAYBACK CONTROL',
 }
 
+# Per-opcode vendor range membership (1 if the opcode is in VENDOR_RANGES)
+_VENDOR = bytes(1 if any(lo <= i <= hi for lo, hi in VENDOR_RANGES) else 0 for i in range(256))
+
+# Opcode -> mnemonic lookup tables, custom entries taking precedence
+_CMD_LUT = tuple(CUSTOM_ATA_COMMANDS.get(i, ATA_COMMANDS.get(i,
+                 'VENDOR SPECIFIC' if _VENDOR[i] else 'UNKNOWN')) for i in range(256))
+_CDB_LUT = tuple(CUSTOM_ATAPI_CDB.get(i, ATAPI_CDB.get(i, 'SCSI CDB')) for i in range(256))
+
+# Preformatted hex bytes and annotation templates
+_HEX = tuple('%02X' % i for i in range(256))
+_CMD_TXT = tuple('CMD 0x%s %s' % (_HEX[i], _CMD_LUT[i]) for i in range(256))
+_CDB_TXT = tuple('ATAPI CDB[0]=0x%s %s' % (_HEX[i], _CDB_LUT[i]) for i in range(256))
+_REG_FMT = {r: r + ' = 0x%s' for r in (
+    'features', 'sector_count', 'lba0', 'lba1', 'lba2', 'device',
+    'hob_features', 'hob_sector_count', 'hob_lba0', 'hob_lba1', 'hob_lba2')}
+_READ_FMT = {r: r.upper() + ' read: 0x%s' for r in (
+    'data', 'error', 'sector_count', 'lba0', 'lba1', 'lba2', 'device',
+    'status', 'altstatus', 'drive_addr')}
+
+# Chip select bits of the packed register select word (see decode())
+_CS_MASK = (1 << 4) | (1 << 3)
+
+# Register decode for one (CS0, CS1, DA) selection; chip selects are given
+# as active-high booleans. Only used to build the lookup tables below.
+def reg_name_of(cs0, cs1, da, is_write):
+    if cs0 and not cs1:
+        # Task file
+        if da == 0:
+            return 'data'
+        elif da == 1:
+            return 'features' if is_write else 'error'
+        elif da == 2:
+            return 'sector_count'
+        elif da == 3:
+            return 'lba0'
+        elif da == 4:
+            return 'lba1'
+        elif da == 5:
+            return 'lba2'
+        elif da == 6:
+            return 'device'
+        elif da == 7:
+            return 'command' if is_write else 'status'
+    elif cs1 and not cs0:
+        # Control block
+        if da == 6:
+            return 'devctl' if is_write else 'altstatus'
+        elif da == 7:
+            return 'drive_addr'
+    return None
+
+# Register name lookup tables indexed by (cs0 << 4) | (cs1 << 3) | da
+_REG_W = tuple(reg_name_of(i >> 4, (i >> 3) & 1, i & 7, True) for i in range(32))
+_REG_R = tuple(reg_name_of(i >> 4, (i >> 3) & 1, i & 7, False) for i in range(32))
+
+# ---------------------------- Task-file shadow ------------------------------
+
+class TaskFile:
+    # Low-order registers plus the HOB (high order byte) copies for LBA48
+    __slots__ = (
+        'features', 'sector_count', 'lba0', 'lba1', 'lba2', 'device',
+        'hob_features', 'hob_sector_count', 'hob_lba0', 'hob_lba1', 'hob_lba2',
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
 # ---------------------------- Decoder class ---------------------------------
 
 class Decoder(srd.Decoder):
@@ -301,216 +375,219 @@ def start(self):
         self.reset()
 
     def reset(self):
-        # Cached channel indices for speed
-        def idx(id_):
-            try:
-                return self.channels.index(next(ch for ch in self.channels if ch['id']==id_))
-            except StopIteration:
-                # Fallback for optional lookups using get_sig()
-                return None
         # Build a dict id->index for quick sampling
         self.ch_idx = {ch['id']: i for i,ch in enumerate(self.channels)}
         self.opt_idx = {ch['id']: (len(self.channels)+i) for i,ch in enumerate(self.optional_channels)}
+        self._d_idx = tuple(self.ch_idx[f'd{i}'] for i in range(8))
+        self._da0 = self.ch_idx['da0']
+        self._da1 = self.ch_idx['da1']
+        self._da2 = self.ch_idx['da2']
+        self._cs0 = self.ch_idx['cs0']
+        self._cs1 = self.ch_idx['cs1']
 
         # Task-file shadow (low + high order if HOB active)
-        self.tf = {
-            'features':0,'sector_count':0,'lba0':0,'lba1':0,'lba2':0,'device':0,
-            'hob_features':0,'hob_sector_count':0,'hob_lba0':0,'hob_lba1':0,'hob_lba2':0,
-        }
+        self.tf = TaskFile()
         self.hob = 0  # Device Control bit7 High Order Byte select
+        self._hob_dirty = False  # HOB SC/LBA written since the last command (LBA48)
         self.in_cdb = False
         self.cdb_bytes_expected = 0
         self.cdb_buf = []
 
+        # Option flags, looked up once instead of on every strobe
+        self._sq = self.options['squelch_dma']
+        self._parse = self.options['parse_cdb']
+        self._ign = self.options['ignore_data']
+        self._emit = self.options['emit_reads']
+
+        # Optional signals sampled on the hot path (None when not connected)
+        idx, ok = self.get_sig('dmarq')
+        self._dmarq_idx = idx if ok else None
+        idx, ok = self.get_sig('intrq')
+        self._intrq_idx = idx if ok else None
+
+        self.build_waitlist()
+
     # -------------------------- Helpers / sampling --------------------------
     def get_sig(self, name):
         # Return (index, presentbool). Works for optional channels too.
         if name in self.ch_idx:
             return self.ch_idx[name], True
         if name in self.opt_idx:
-            return self.opt_idx[name], True
+            idx = self.opt_idx[name]
+            return idx, self.has_channel(idx)
         return None, False
 
-    def rd_bit(self, name):
-        idx, ok = self.get_sig(name)
-        if not ok:
-            return 0
-        return self.samples[idx]
-
-    def rd_bus8(self):
-        v = 0
-        for i,name in enumerate(['d0','d1','d2','d3','d4','d5','d6','d7']):
-            v |= (1 if self.rd_bit(name) else 0) << i
-        return v & 0xFF
-
-    def rd_addr(self):
-        a = (1 if self.rd_bit('da0') else 0) | ((1 if self.rd_bit('da1') else 0) << 1) | ((1 if self.rd_bit('da2') else 0) << 2)
-        return a
-
-    def cs_sel(self):
-        cs0 = not self.rd_bit('cs0')  # active-low
-        cs1 = not self.rd_bit('cs1')
-        return cs0, cs1
-
-    def puta(self, ss, es, aidx, text):
-        self.put(ss, es, self.out_ann, [aidx, [text]])
-
-    def reg_name(self, cs0, cs1, da, is_write):
-        if cs0 and not cs1:
-            # Task file
-            if da == 0:
-                return 'data'
-            elif da == 1:
-                return 'features' if is_write else 'error'
-            elif da == 2:
-                return 'sector_count'
-            elif da == 3:
-                return 'lba0'
-            elif da == 4:
-                return 'lba1'
-            elif da == 5:
-                return 'lba2'
-            elif da == 6:
-                return 'device'
-            elif da == 7:
-                return 'command' if is_write else 'status'
-        elif cs1 and not cs0:
-            # Control block
-            if da == 6:
-                return 'devctl' if is_write else 'altstatus'
-            elif da == 7:
-                return 'drive_addr'
-        return None
+    def build_waitlist(self):
+        # Falling edges of the read/write strobes with exactly one chip
+        # select asserted, narrowed down to the registers decode() acts
+        # on. libsigrokdecode drops all other strobes (most notably PIO
+        # data transfers) before they reach Python. Depends on the options
+        # and on the CDB window, so rebuild when in_cdb changes.
+        diow = self.ch_idx['diow']
+        dior = self.ch_idx['dior']
+        tf = {self._cs0: 'l', self._cs1: 'h'}  # Task file block
+        cb = {self._cs0: 'h', self._cs1: 'l'}  # Control block
+        da0, da1, da2 = self._da0, self._da1, self._da2
+        conds = []
+        # Writes: task file (Data only if decoded), Device Control
+        if self.in_cdb or not self._ign:
+            conds.append({diow: 'f', **tf})
+        else:
+            conds.extend({diow: 'f', **tf, da: 'h'} for da in (da0, da1, da2))
+        conds.append({diow: 'f', **cb, da0: 'l', da1: 'h', da2: 'h'})
+        self._nwr = len(conds)
+        # Reads: Status/AltStatus, others only if annotated
+        if self._emit:
+            conds.append({dior: 'f', **tf})
+            conds.append({dior: 'f', **cb, da1: 'h', da2: 'h'})
+        else:
+            conds.append({dior: 'f', **tf, da0: 'h', da1: 'h', da2: 'h'})
+            if not self._ign:
+                conds.append({dior: 'f', **tf, da0: 'l', da1: 'l', da2: 'l'})
+            conds.append({dior: 'f', **cb, da0: 'l', da1: 'h', da2: 'h'})
+        # Optional: squelch during DMA phases. DMARQ high usually means DMA
+        # data phase; such strobes are not even reported to decode().
+        if self._sq and self._dmarq_idx is not None:
+            for cond in conds:
+                cond[self._dmarq_idx] = 'l'
+        self._conds = conds
 
     def lba_mode(self):
-        return 'LBA' if (self.tf['device'] & 0x40) else 'CHS'
+        return 'LBA' if (self.tf.device & 0x40) else 'CHS'
 
-    def lba28(self):
-        dev_low4 = self.tf['device'] & 0x0F
-        return ((dev_low4 << 24) | (self.tf['lba2'] << 16) | (self.tf['lba1'] << 8) | self.tf['lba0']) & 0x0FFFFFFF
+    # LBA28 (DEV[3:0] + LBA2..0) and LBA48 (HOB LBA2..0 + LBA2..0) as hex,
+    # assembled from the per-byte table
+    def lba28_hex(self):
+        tf = self.tf
+        return ''.join((_HEX[tf.device & 0x0F], _HEX[tf.lba2], _HEX[tf.lba1], _HEX[tf.lba0]))
 
-    def lba48(self):
-        hi = (self.tf['hob_lba2'] << 16) | (self.tf['hob_lba1'] << 8) | self.tf['hob_lba0']
-        lo = (self.tf['lba2']     << 16) | (self.tf['lba1']     << 8) | self.tf['lba0']
-        return ((hi << 24) | lo) & 0xFFFFFFFFFFFF
+    def lba48_hex(self):
+        tf = self.tf
+        return ''.join((_HEX[tf.hob_lba2], _HEX[tf.hob_lba1], _HEX[tf.hob_lba0],
+                        _HEX[tf.lba2], _HEX[tf.lba1], _HEX[tf.lba0]))
 
     def sc48(self):
-        return ((self.tf['hob_sector_count'] << 8) | self.tf['sector_count']) & 0xFFFF
+        return ((self.tf.hob_sector_count << 8) | self.tf.sector_count) & 0xFFFF
 
     # ------------------------------- Decode ---------------------------------
     def decode(self):
-        # acquire channel indices for fast edge wait()
-        idx_diow = self.ch_idx['diow']
-        idx_dior = self.ch_idx['dior']
-        # minimal wait list: falling edge of read/write strobes
-        waitlist = [{idx_diow: 'f'}, {idx_dior: 'f'}]
+        # Bind put() once; annotations go straight to the C layer without
+        # an extra Python-level helper call per event.
+        put = self.put
+        ann = self.out_ann
+        # Bus sampling is inlined below on local indices; it runs for every
+        # strobe and method calls would dominate its cost.
+        d0, d1, d2, d3, d4, d5, d6, d7 = self._d_idx
+        cs0, cs1 = self._cs0, self._cs1
+        da0, da1, da2 = self._da0, self._da1, self._da2
 
         while True:
             # Wait for a bus strobe (write/read)
-            self.wait(waitlist)
+            # wait() returns the pin values at the strobe edge; use them as
+            # the sample snapshot instead of copying every channel.
+            s = self.wait(self._conds)
             ss = self.samplenum
-            # Snapshot all relevant signals at this strobe edge
-            self.samples = [self.logic[i] for i in range(len(self.logic))] if hasattr(self, 'logic') else [self.matched.get(i, 0) for i in range(max(self.opt_idx.values())+1)]
-
-            is_write = (self.matched.get(idx_diow, 1) == 0)  # DIOW- active low at this instant
-            is_read  = (self.matched.get(idx_dior, 1) == 0)
 
-            # Optional: squelch during DMA phases
-            if self.options['squelch_dma']:
-                idx_dmarq, ok = self.get_sig('dmarq')
-                if ok and self.samples[idx_dmarq]:
-                    # DMARQ high usually means DMA data phase; hide chatter
-                    continue
+            # Write conditions come first in the wait list
+            is_write = self.matched.index(True) < self._nwr
+            is_read  = not is_write
 
-            # Determine selection and address
-            cs0, cs1 = self.cs_sel()
-            da = self.rd_addr()
-            reg = self.reg_name(cs0, cs1, da, is_write)
+            # Determine selection and address: pack chip selects (as
+            # active-high) and DA2..DA0 into (cs0 << 4) | (cs1 << 3) | da.
+            # CS0-/CS1- are active low, so XOR with _CS_MASK inverts both.
+            sel = ((s[cs0] << 4) | (s[cs1] << 3) | (s[da2] << 2) |
+                   (s[da1] << 1) | s[da0]) ^ _CS_MASK
+            reg = (_REG_W if is_write else _REG_R)[sel]
 
             # Only react to valid register cycles
             if not reg:
                 continue
 
-            val = self.rd_bus8()
+            val = (s[d0] | (s[d1] << 1) | (s[d2] << 2) | (s[d3] << 3) |
+                   (s[d4] << 4) | (s[d5] << 5) | (s[d6] << 6) | (s[d7] << 7))
             es = self.samplenum
 
             # Handle Device Control & HOB
             if reg == 'devctl' and is_write:
                 self.hob = 1 if (val & 0x80) else 0
                 txt = f"DEVCTL write: SRST={(val>>2)&1} nIEN={(val>>1)&1} HOB={(val>>7)&1}"
-                self.puta(ss, es, 5, txt)
+                put(ss, es, ann, [5, [txt]])
                 continue
 
-            # Reads (optional annotation)
-            if (reg in ('status','altstatus') and is_read) or (self.options['emit_reads'] and is_read):
-                self.puta(ss, es, 4, f"{reg.upper()} read: 0x{val:02X}")
+            # Status reads
+            if is_read and (reg == 'status' or reg == 'altstatus'):
+                put(ss, es, ann, [4, [_READ_FMT[reg] % _HEX[val]]])
                 # On Status read, a device might clear INTRQ; annotate if seen.
-                idx_intrq, ok = self.get_sig('intrq')
-                if ok and not self.samples[idx_intrq]:
-                    self.puta(ss, es, 6, 'INTRQ cleared')
+                idx = self._intrq_idx
+                if idx is not None and not s[idx]:
+                    put(ss, es, ann, [6, ['INTRQ cleared']])
+                continue
+
+            # Other reads (optional annotation)
+            if is_read and self._emit:
+                put(ss, es, ann, [4, [_READ_FMT[reg] % _HEX[val]]])
                 continue
 
             # Writes to task-file parameters
             if is_write and reg in ('features','sector_count','lba0','lba1','lba2','device'):
                 if self.hob and reg in ('features','sector_count','lba0','lba1','lba2'):
                     hreg = 'hob_'+reg
-                    self.tf[hreg] = val
-                    self.puta(ss, es, 0, f"{hreg} = 0x{val:02X}")
+                    setattr(self.tf, hreg, val)
+                    if reg != 'features':
+                        self._hob_dirty = True
+                    put(ss, es, ann, [0, [_REG_FMT[hreg] % _HEX[val]]])
                 else:
-                    self.tf[reg] = val
-                    self.puta(ss, es, 0, f"{reg} = 0x{val:02X}")
+                    setattr(self.tf, reg, val)
+                    put(ss, es, ann, [0, [_REG_FMT[reg] % _HEX[val]]])
                 continue
 
             # Data register accesses
             if reg == 'data':
                 # If we are in ATAPI PACKET CDB window, collect bytes.
                 if self.in_cdb and is_write:
-                    if self.options['parse_cdb']:
+                    if self._parse:
                         self.cdb_buf.append(val)
                         if len(self.cdb_buf) == 1:
-                            c0 = self.cdb_buf[0]
-                            name = CUSTOM_ATAPI_CDB.get(c0) or ATAPI_CDB.get(c0) or 'SCSI CDB'
-                            self.puta(ss, es, 3, f"ATAPI CDB[0]=0x{c0:02X} {name}")
+                            put(ss, es, ann, [3, [_CDB_TXT[val]]])
                         if self.cdb_bytes_expected and len(self.cdb_buf) >= self.cdb_bytes_expected:
                             self.in_cdb = False
-                            self.puta(ss, es, 3, f"CDB complete ({len(self.cdb_buf)} bytes)")
+                            self.build_waitlist()
+                            put(ss, es, ann, [3, ['CDB complete (%d bytes)' % len(self.cdb_buf)]])
                     else:
                         # not parsing: still mark
-                        self.puta(ss, es, 3, "ATAPI CDB byte")
+                        put(ss, es, ann, [3, ["ATAPI CDB byte"]])
                     continue
                 # Otherwise ignore Data reg if option enabled
-                if self.options['ignore_data']:
+                if self._ign:
                     continue
                 # If not ignoring, annotate raw data access
-                op = 'WRITE' if is_write else 'READ'
-                self.puta(ss, es, 0 if is_write else 1, f"DATA {op}: 0x{val:02X}")
+                if is_write:
+                    put(ss, es, ann, [0, ['DATA WRITE: 0x' + _HEX[val]]])
+                else:
+                    put(ss, es, ann, [1, ['DATA READ: 0x' + _HEX[val]]])
                 continue
 
             # Command write: emit a full command annotation
             if reg == 'command' and is_write:
                 op = val
-                name = CUSTOM_ATA_COMMANDS.get(op) or ATA_COMMANDS.get(op) or 'UNKNOWN'
                 # Detect ATAPI PACKET which triggers CDB window
                 if op == 0xA0:
                     self.in_cdb = True
+                    self.build_waitlist()
                     # ATAPI PACKET is typically 12 bytes for MMC; some devices use 16
                     self.cdb_bytes_expected = 12
                     self.cdb_buf = []
                 # Build parameter summary
                 mode = self.lba_mode()
-                sc = self.tf['sector_count']
-                lba = self.lba28()
-                hob_any = any(self.tf[k] for k in ('hob_sector_count','hob_lba0','hob_lba1','hob_lba2'))
-                if hob_any:
+                if self._hob_dirty:
                     sc = self.sc48()
-                    lba = self.lba48()
-                sc_str = f"SC={sc}"
-                lba_str = f"LBA48=0x{lba:012X}" if hob_any else f"LBA28=0x{lba:08X}"
-                dev = self.tf['device']
-                dev_str = f"DEV=0x{dev:02X}({mode})"
-                self.puta(ss, es, 2, f"CMD 0x{op:02X} {name}  {sc_str}  {lba_str}  {dev_str}")
+                    lba_str = 'LBA48=0x' + self.lba48_hex()
+                else:
+                    sc = self.tf.sector_count
+                    lba_str = 'LBA28=0x' + self.lba28_hex()
+                dev = self.tf.device
+                put(ss, es, ann, [2, ['%s  SC=%d  %s  DEV=0x%s(%s)' %
+                                      (_CMD_TXT[op], sc, lba_str, _HEX[dev], mode)]])
+                # Each LBA48 command rewrites its HOB bytes
+                self._hob_dirty = False
                 continue
-
-            # Other reads
-            if self.options['emit_reads'] and is_read:
-                self.puta(ss, es, 1, f"{reg} read: 0x{val:02X}")